@@ -1,23 +1,45 @@
+import hashlib
+import time
+from threading import Lock
+from cachetools import TTLCache
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from firebase_admin.auth import InvalidIdTokenError, ExpiredIdTokenError
 
-# Import the pre-initialized auth module from your firebase_config
-from firebase_config import firebase_auth 
+# Import the auth module and lazy app getter from your firebase_config
+from firebase_config import firebase_auth, get_app
 
 # This tells FastAPI to look for an 'Authorization: Bearer <token>' header.
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Verified tokens, keyed by a hash of the raw token: digest -> (exp, decoded_token).
+# Firebase ID tokens live for 1 hour, which matches the TTL; `exp` is still
+# checked on every hit so a token is never served past its own expiry.
+_token_cache = TTLCache(maxsize=10000, ttl=3600)
+_token_cache_lock = Lock()  # TTLCache mutates (expires entries) even on reads
+
+def _token_key(token: str) -> str:
+    return hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
+
 def get_current_user(token: str = Depends(oauth2_scheme)):
     """
     A FastAPI dependency that verifies the Firebase ID token
     and returns the user's decoded token (payload).
     
     If the token is invalid or expired, it raises an HTTPException.
+    Successfully verified tokens are cached until their `exp` claim.
     """
+    key = _token_key(token)
+    with _token_cache_lock:
+        cached = _token_cache.get(key)
+    if cached and cached[0] > time.time():
+        return cached[1]
+
     try:
         # Verify the token against the Firebase Auth API
-        decoded_token = firebase_auth.verify_id_token(token)
+        decoded_token = firebase_auth.verify_id_token(token, app=get_app())
+        with _token_cache_lock:
+            _token_cache[key] = (decoded_token["exp"], decoded_token)
         return decoded_token
         
     except ExpiredIdTokenError:
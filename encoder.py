@@ -0,0 +1,240 @@
+# encoder.py
+import os
+import shutil
+import tempfile
+import numpy as np
+import onnxruntime as ort
+from functools import lru_cache
+from transformers import AutoTokenizer
+from typing import Any, List, NamedTuple, Union
+
+MODEL_NAME = "sentence-transformers/all-mpnet-base-v2"
+MAX_SEQ_LENGTH = 384
+EMBEDDING_DIM = 768
+# Upper bound on padded tokens (rows x longest row) per inference batch. Must stay
+# below batch_size x MAX_SEQ_LENGTH (12288 at the defaults) to ever take effect:
+# 4096 lets short answers fill a 32-row batch while long ones get smaller batches.
+MAX_BATCH_TOKENS = int(os.environ.get("MAX_BATCH_TOKENS", 4096))
+
+# Exported + INT8-quantized model lives here (created by `python -m encoder`)
+ONNX_MODEL_DIR = os.environ.get("ONNX_MODEL_DIR", "onnx_model")
+FP32_MODEL_FILE = "model.onnx"
+OPTIMIZED_MODEL_FILE = "model_optimized.onnx"
+QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+FP16_MODEL_FILE = "model_fp16.onnx"
+
+# Defaults to every core; set ORT_NUM_THREADS to share the box with other workers
+NUM_THREADS = int(os.environ.get("ORT_NUM_THREADS", os.cpu_count() or 1))
+
+
+def export_quantized_model(save_dir: str = ONNX_MODEL_DIR) -> str:
+    """
+    Export MPNet to ONNX, fuse its transformer subgraphs, then apply dynamic
+    INT8 quantization. Returns the model path.
+    """
+    # optimum is only needed for the one-off export, not for serving
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTOptimizer, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig, OptimizationConfig
+
+    ort_model = ORTModelForFeatureExtraction.from_pretrained(MODEL_NAME, export=True)
+    ort_model.save_pretrained(save_dir)
+    AutoTokenizer.from_pretrained(MODEL_NAME).save_pretrained(save_dir)
+
+    # Fuse attention/GELU/LayerNorm on the fp32 graph. This has to happen before
+    # quantization: once MatMuls become MatMulInteger nodes the fusion patterns
+    # no longer match, so ORT can't do it at session load time.
+    optimizer = ORTOptimizer.from_pretrained(ort_model)
+    optimizer.optimize(
+        save_dir=save_dir,
+        optimization_config=OptimizationConfig(optimization_level=2, optimize_for_gpu=False),
+    )
+
+    quantizer = ORTQuantizer.from_pretrained(save_dir, file_name=OPTIMIZED_MODEL_FILE)
+    qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    quantizer.quantize(save_dir=save_dir, quantization_config=qconfig)
+
+    # optimum names the output after its input (model_optimized_quantized.onnx)
+    quantized_path = os.path.join(save_dir, QUANTIZED_MODEL_FILE)
+    os.replace(os.path.join(save_dir, "model_optimized_quantized.onnx"), quantized_path)
+    return quantized_path
+
+
+def export_fp16_model(save_dir: str = ONNX_MODEL_DIR) -> str:
+    """Convert the fp32 ONNX export to FP16 for GPU serving. Returns the model path."""
+    import onnx
+    from onnxruntime.transformers.float16 import convert_float_to_float16
+
+    fp32_path = os.path.join(save_dir, FP32_MODEL_FILE)
+    if not os.path.exists(fp32_path):
+        export_quantized_model(save_dir)
+
+    # keep_io_types leaves the outputs in fp32, so pooling code is unchanged
+    fp16_model = convert_float_to_float16(onnx.load(fp32_path), keep_io_types=True)
+    fp16_path = os.path.join(save_dir, FP16_MODEL_FILE)
+    onnx.save(fp16_model, fp16_path)
+    return fp16_path
+
+
+def export_models(save_dir: str = ONNX_MODEL_DIR, fp16: bool = False) -> None:
+    """
+    Build every model file in a temp directory next to save_dir, then swap it
+    into place with renames, so a server never sees a half-written model.
+
+    An existing export is renamed aside first and deleted after the swap. A
+    worker booting in the instant between those two renames finds no model
+    and fails to start, so re-export while no workers are booting.
+    """
+    parent = os.path.dirname(os.path.abspath(save_dir))
+    tmp_dir = tempfile.mkdtemp(prefix=".onnx_export_", dir=parent)
+    try:
+        export_quantized_model(tmp_dir)
+        if fp16:
+            export_fp16_model(tmp_dir)
+        # mkdtemp creates 0700; serving often runs as a different user than the export
+        os.chmod(tmp_dir, 0o755)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    old_dir = None
+    if os.path.exists(save_dir):
+        old_dir = f"{tmp_dir}.old"
+        os.replace(save_dir, old_dir)
+    os.replace(tmp_dir, save_dir)
+    if old_dir:
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+
+class LoadedModel(NamedTuple):
+    session: ort.InferenceSession
+    tokenizer: Any
+    input_names: List[str]
+    # Identifies which graph produced an embedding (int8 and fp16 outputs differ slightly)
+    model_id: str
+
+
+@lru_cache(maxsize=None)
+def load_model() -> LoadedModel:
+    """
+    Load the exported model once. Exporting never happens here: run
+    `python -m encoder` beforehand so serving workers don't race to build it.
+    """
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = NUM_THREADS
+
+    fp16_path = os.path.join(ONNX_MODEL_DIR, FP16_MODEL_FILE)
+    if "CUDAExecutionProvider" in ort.get_available_providers() and os.path.exists(fp16_path):
+        # Dynamic INT8 kernels are CPU-only; on GPU serve the FP16 graph instead
+        model_path = fp16_path
+        providers = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+    else:
+        model_path = os.path.join(ONNX_MODEL_DIR, QUANTIZED_MODEL_FILE)
+        providers = ["CPUExecutionProvider"]
+
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(
+            f"{model_path} not found. Run `python -m encoder` (add --fp16 for CUDA) to export the model."
+        )
+
+    session = ort.InferenceSession(model_path, sess_options=options, providers=providers)
+    return LoadedModel(
+        session=session,
+        tokenizer=AutoTokenizer.from_pretrained(ONNX_MODEL_DIR),
+        input_names=[i.name for i in session.get_inputs()],
+        model_id=f"{MODEL_NAME}:{os.path.basename(model_path)}",
+    )
+
+
+def _mean_pool(token_embeddings: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+    """Average token embeddings, ignoring padding (same pooling as sentence-transformers)."""
+    mask = attention_mask[..., None].astype(np.float32)
+    summed = (token_embeddings * mask).sum(axis=1)
+    counts = np.clip(mask.sum(axis=1), 1e-9, None)
+    return summed / counts
+
+
+def _normalize(embeddings: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.clip(norms, 1e-12, None)
+
+
+def _embed(features) -> np.ndarray:
+    """Run one tokenized batch through the session and mean-pool it."""
+    model = load_model()
+    feeds = {name: features[name].astype(np.int64) for name in model.input_names}
+    token_embeddings = model.session.run(None, feeds)[0]
+    return _mean_pool(token_embeddings, features["attention_mask"])
+
+
+def _length_sorted_batches(lengths: List[int], batch_size: int, max_batch_tokens: int) -> List[List[int]]:
+    """
+    Group text indices longest-first so each batch only pads to its own longest
+    member. A batch is closed when it reaches batch_size or when its padded
+    size (rows x longest length) would exceed max_batch_tokens.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    batches, current = [], []
+    for i in order:
+        # Sorted descending, so the first index sets the padded length of the batch
+        padded_len = lengths[current[0]] if current else lengths[i]
+        if current and (len(current) == batch_size or padded_len * (len(current) + 1) > max_batch_tokens):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def encode(
+    texts: Union[str, List[str]],
+    batch_size: int = 32,
+    max_batch_tokens: int = MAX_BATCH_TOKENS,
+) -> np.ndarray:
+    """
+    Encode text(s) into L2-normalized float32 embeddings.
+
+    A single string returns a (768,) vector; a list returns an (n, 768) matrix
+    in input order. Because the output is normalized, cosine similarity is a
+    plain dot product.
+    """
+    tokenizer = load_model().tokenizer
+    if isinstance(texts, str):
+        # Hot path for /evaluate_answer: a single text needs no sorting or padding
+        features = tokenizer(texts, truncation=True, max_length=MAX_SEQ_LENGTH, return_tensors="np")
+        return _normalize(_embed(features))[0]
+    if not texts:
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+
+    # Tokenize once without padding; padding is applied per length-sorted batch
+    encoded = tokenizer(texts, padding=False, truncation=True, max_length=MAX_SEQ_LENGTH)
+    lengths = [len(ids) for ids in encoded["input_ids"]]
+
+    embeddings = np.empty((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    for batch in _length_sorted_batches(lengths, batch_size, max_batch_tokens):
+        features = tokenizer.pad(
+            {key: [encoded[key][i] for i in batch] for key in encoded.keys()},
+            return_tensors="np",
+        )
+        embeddings[batch] = _embed(features)
+
+    return _normalize(embeddings)
+
+
+def warmup(runs: int = 3) -> None:
+    """
+    Run a few throwaway encodes so kernel selection and arena allocation
+    happen at startup. Without this the first real request is noticeably slow.
+    """
+    for _ in range(runs):
+        encode("warmup text")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export the ONNX models served by the evaluation API.")
+    parser.add_argument("--fp16", action="store_true", help="also build the FP16 graph used on CUDA")
+    args = parser.parse_args()
+    export_models(fp16=args.fp16)
+    print(f"Exported models to {ONNX_MODEL_DIR}")
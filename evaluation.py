@@ -1,83 +1,275 @@
 import json
+import os
+import asyncio
+import hashlib
+import glob
+import weakref
+import numpy as np
 from fastapi import FastAPI, HTTPException, Depends  # Added Depends and HTTPException
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from sentence_transformers import SentenceTransformer, util
+from encoder import encode, warmup, load_model, EMBEDDING_DIM
 from leaderboard import router as leaderboard_router
-from firebase_config import db
-from typing import Optional, Dict, Any
+from firebase_config import get_db, get_async_db
+from typing import Optional, Dict, Any, Tuple, List
+from collections import defaultdict
 import time
 
 # --- New Imports for Auth & Caching ---
 from auth import get_current_user  # Import the auth dependency
-from cachetools import TTLCache     # Import a thread-safe cache
-from threading import Lock          # For thread-safe cache access
+from concurrent.futures import ThreadPoolExecutor  # Runs encodes off the event loop
 
-app = FastAPI()
+# orjson serializes the nested all_scores payloads much faster than json.dumps
+app = FastAPI(default_response_class=ORJSONResponse)
 app.include_router(leaderboard_router)
 
-# Load model once
-model = SentenceTransformer('all-mpnet-base-v2')
+# Load the model once (export it first with `python -m encoder`)
+load_model()
 
-# --- Thread-Safe Cache Setup ---
+# ONNX Runtime releases the GIL during inference, so threads (not processes) are enough
+ENCODE_WORKERS = int(os.environ.get("ENCODE_WORKERS", 4))
+encode_pool = ThreadPoolExecutor(max_workers=ENCODE_WORKERS)
+
+# --- Cache Setup ---
 CACHE_TTL = 300  # 5 minutes cache TTL
-# maxsize=100 (100 questions), ttl=300 (5 seconds)
-question_cache = TTLCache(maxsize=100, ttl=CACHE_TTL)
-question_cache_lock = Lock()  # Lock to ensure thread-safe operations
+MAX_CACHED_QUESTIONS = 100
+# question_id -> (cached_at, question). Only touched from the event loop, so
+# hits are a plain dict .get() with no lock. An asyncio lock is only taken per question
+# on a miss, so one slow load doesn't block requests for other questions.
+question_cache: Dict[int, Tuple[float, dict]] = {}
+# Weak values: a lock disappears once no request holds or waits on it, so
+# arbitrary (even non-existent) question ids can't grow this without bound.
+question_locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+# Existing QnA documents have auto-generated IDs, so questions are found by their
+# `id` field. Set QNA_DOC_ID_LOOKUP=1 once documents are keyed by str(id).
+QNA_DOC_ID_LOOKUP = os.environ.get("QNA_DOC_ID_LOOKUP", "0") == "1"
+
+# --- On-Disk Embedding Cache ---
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", "embedding_cache")
+# The cache key is part of the file name, so a matrix can never be paired with
+# metadata from a different run
+EMBEDDING_CACHE_PATTERN = os.path.join(EMBEDDING_CACHE_DIR, "ref_embeddings_{key}.npy")
+
+# --- Reference Quantization ---
+# Opt-in only. Normalized vectors have components in [-1, 1], so a fixed 127 scale
+# maps them to int8, but scoring then widens refs to int32 on every request and
+# runs a non-BLAS matmul, adds ~0.003 noise to scores, and copies the mmapped
+# disk cache into RAM. float32 scoring stays the default unless a benchmark on
+# real data shows a win. Questions flagged `high_precision` always stay float32.
+QUANTIZE_REFERENCES = os.environ.get("QUANTIZE_REFERENCES", "0") == "1"
+INT8_SCALE = 127
 
 # --- Data Loading ---
 
+def embed_answers(answers, batch_size: int = 32):
+    """Encode reference answers into one contiguous (n_answers, 768) float32 matrix."""
+    return np.ascontiguousarray(encode(answers, batch_size=batch_size), dtype=np.float32)
+
+def _embedding_cache_key(answers):
+    """Hash of the model and every answer, so any edit invalidates the disk cache."""
+    digest = hashlib.sha256(load_model().model_id.encode())
+    for ans in answers:
+        digest.update(ans.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def load_or_embed_answers(answers):
+    """Embed answers, reusing the on-disk copy if the answers and model are unchanged."""
+    if not answers:
+        return embed_answers(answers)  # Nothing worth caching (and empty arrays can't be mmapped)
+
+    cache_key = _embedding_cache_key(answers)
+    cache_file = EMBEDDING_CACHE_PATTERN.format(key=cache_key)
+    try:
+        # mmap: pages are read lazily instead of loading the whole matrix eagerly
+        cached = np.load(cache_file, mmap_mode="r")
+        if cached.shape == (len(answers), EMBEDDING_DIM) and cached.dtype == np.float32:
+            return cached
+    except (OSError, ValueError):
+        pass  # No cache yet, or it is unreadable; re-encode below
+
+    embeddings = embed_answers(answers, batch_size=32)
+
+    # Write to a temp file and rename, so concurrent workers never read a partial file
+    os.makedirs(EMBEDDING_CACHE_DIR, exist_ok=True)
+    tmp_file = os.path.join(EMBEDDING_CACHE_DIR, f"tmp_{os.getpid()}_{cache_key}.npy")
+    np.save(tmp_file, embeddings)
+    os.replace(tmp_file, cache_file)
+
+    # Drop matrices for older answer sets (already-mmapped copies stay readable)
+    for stale_file in glob.glob(EMBEDDING_CACHE_PATTERN.format(key="*")):
+        if stale_file != cache_file:
+            try:
+                os.remove(stale_file)
+            except OSError:
+                pass
+    return embeddings
+
+def _question_from_doc(doc):
+    q = doc.to_dict()
+    return {
+        "id": q.get("id"),
+        "question": q.get("question_text"),
+        "answers": q.get("answers", []),
+        "high_precision": bool(q.get("high_precision", False))
+    }
+
+def quantize_int8(embeddings: np.ndarray) -> np.ndarray:
+    """Quantize L2-normalized float32 embeddings to int8 (4x smaller)."""
+    return np.round(embeddings * INT8_SCALE).astype(np.int8)
+
+def _attach_embeddings(question: dict, embeddings: np.ndarray):
+    """Store reference embeddings on a question, as int8 unless it needs full precision."""
+    if QUANTIZE_REFERENCES and not question.get("high_precision"):
+        embeddings = quantize_int8(embeddings)
+    question["embeddings"] = embeddings
+
+def compute_similarities(ref_embeddings: np.ndarray, user_embs: np.ndarray) -> np.ndarray:
+    """
+    Cosine similarities between user embedding(s) and a question's references.
+    A (768,) user vector gives (n_refs,); an (m, 768) matrix gives (m, n_refs).
+    """
+    if ref_embeddings.dtype == np.int8:
+        # Quantize the user side the same way; int32 accumulation can't overflow at 768 dims
+        q_user = quantize_int8(user_embs).astype(np.int32)
+        return (q_user @ ref_embeddings.T).astype(np.float32) / (INT8_SCALE * INT8_SCALE)
+    return user_embs @ ref_embeddings.T
+
 def load_reference_data():
     """Loads all question headers from Firestore."""
-    qna_ref = db.collection("QnA").stream()
-    questions = []
-    for doc in qna_ref:
-        q = doc.to_dict()
-        questions.append({
-            "id": q.get("id"),
-            "question": q.get("question_text"),
-            "answers": q.get("answers", [])
-        })
-    return questions
-
-def get_question_with_embeddings(question_id: int, use_cache: bool = True):
-    """Load a specific question and compute its embeddings on-demand (thread-safe)"""
-    
-    if use_cache:
-        # Check cache (thread-safe)
-        with question_cache_lock:
-            cached_question = question_cache.get(question_id)
-        if cached_question:
-            return cached_question
-            
-    # Load from Firestore
-    qna_ref = db.collection("QnA").where("id", "==", question_id).stream()
-    questions = []
-    for doc in qna_ref:
-        q = doc.to_dict()
-        questions.append({
-            "id": q.get("id"),
-            "question": q.get("question_text"),
-            "answers": q.get("answers", [])
-        })
-        
-    if not questions:
-        return None
-        
-    question = questions[0]
+    # .get() is list(.stream()) under the hood: same RPC, just collected into a list
+    qna_docs = get_db().collection("QnA").get()
+    return [_question_from_doc(doc) for doc in qna_docs]
+
+def _get_cached_question(question_id: int):
+    """Return the cached question if present and not expired (lock-free)."""
+    entry = question_cache.get(question_id)
+    if entry and time.time() - entry[0] < CACHE_TTL:
+        return entry[1]
+    return None
+
+def _cache_question(question_id: int, question: dict):
+    """Store a question, evicting the oldest entry when the cache is full."""
+    if question_id in question_cache:
+        # Re-insert at the end so dict order stays oldest-first
+        question_cache.pop(question_id, None)
+    elif len(question_cache) >= MAX_CACHED_QUESTIONS:
+        # Dicts keep insertion order, so the first key is the oldest entry (O(1), no scan)
+        question_cache.pop(next(iter(question_cache), None), None)
+    question_cache[question_id] = (time.time(), question)
+
+async def _load_question(question_id: int):
+    """Fetch a question from Firestore and compute its embeddings."""
+    qna = get_async_db().collection("QnA")
+    if QNA_DOC_ID_LOOKUP:
+        # Point lookup, for collections whose document IDs are str(question id)
+        doc = await qna.document(str(question_id)).get()
+        if not doc.exists:
+            return None
+    else:
+        docs = await qna.where("id", "==", question_id).limit(1).get()
+        if not docs:
+            return None
+        doc = docs[0]
+
+    question = _question_from_doc(doc)
     
     # Compute embeddings on-demand
+    # Vectors are pre-normalized, so scoring is a single matrix-vector product
     try:
-        question["embeddings"] = model.encode(question["answers"], convert_to_tensor=True)
+        loop = asyncio.get_running_loop()
+        embeddings = await loop.run_in_executor(encode_pool, embed_answers, question["answers"])
     except Exception:
-        question["embeddings"] = [] # Handle questions with no answers
-    
-    # Cache the result if caching is enabled (thread-safe)
-    if use_cache:
-        with question_cache_lock:
-            question_cache[question_id] = question
-            
+        embeddings = np.empty((0, EMBEDDING_DIM), dtype=np.float32) # Handle questions with no answers
+    _attach_embeddings(question, embeddings)
     return question
 
+async def get_question_with_embeddings(question_id: int, use_cache: bool = True):
+    """Load a specific question and compute its embeddings on-demand (concurrency-safe)"""
+    
+    if not use_cache:
+        return await _load_question(question_id)
+
+    cached_question = _get_cached_question(question_id)
+    if cached_question:
+        return cached_question
+
+    # Cache miss: only requests for this same question wait on each other
+    lock = question_locks.get(question_id)
+    if lock is None:
+        lock = question_locks[question_id] = asyncio.Lock()
+    async with lock:
+        # Another request may have filled the cache while we waited
+        cached_question = _get_cached_question(question_id)
+        if cached_question:
+            return cached_question
+
+        question = await _load_question(question_id)
+        if question is not None:
+            _cache_question(question_id, question)
+        return question
+
+def embed_reference_data():
+    """
+    Load every question and embed all reference answers in one batched encode call.
+    Blocking, so it runs in an executor; it does not touch question_cache.
+    """
+    reference_data = load_reference_data()
+
+    # Flatten all answers so the encoder can length-sort and batch across
+    # questions; offsets map rows back to each question.
+    all_answers = [ans for q in reference_data for ans in q["answers"]]
+    offsets = np.cumsum([0] + [len(q["answers"]) for q in reference_data])
+    all_embeddings = load_or_embed_answers(all_answers)
+
+    for q, start, end in zip(reference_data, offsets[:-1], offsets[1:]):
+        _attach_embeddings(q, all_embeddings[start:end])  # row slice, still contiguous
+    return reference_data
+
+def _warm_up_blocking():
+    """Warm up the encoder, then pre-compute embeddings for all questions."""
+    warmup()
+    return embed_reference_data()
+
+# --- Startup ---
+# Workers accept requests immediately; until the warm-up below finishes,
+# questions are simply loaded on demand and /ready reports 503.
+WARM_UP_RETRY_INITIAL_SECONDS = 1
+WARM_UP_RETRY_MAX_SECONDS = 60
+# Only the count is kept: holding the list would pin every embedding matrix
+# in memory even after its question is evicted from question_cache.
+reference_question_count = 0
+reference_data_ready = False
+
+async def _warm_up():
+    """Retry the warm-up with exponential backoff until it succeeds, then fill the cache."""
+    global reference_question_count, reference_data_ready
+    loop = asyncio.get_running_loop()
+    delay = WARM_UP_RETRY_INITIAL_SECONDS
+    while True:
+        try:
+            # Blocking Firestore fetch + bulk encode run off the event loop
+            loaded = await loop.run_in_executor(None, _warm_up_blocking)
+            break
+        except Exception as e:
+            # Not fatal: questions still load on demand while we retry
+            print(f"Warm-up failed, retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WARM_UP_RETRY_MAX_SECONDS)
+
+    # Cache writes happen here, on the event loop, like every other cache access
+    for q in loaded:
+        _cache_question(q["id"], q)
+    reference_question_count = len(loaded)
+    reference_data_ready = True
+    print(f"Warm-up complete: {reference_question_count} questions cached.")
+
+@app.on_event("startup")
+async def start_warm_up():
+    # Keep a reference so the background task isn't garbage-collected mid-run
+    app.state.warm_up_task = asyncio.create_task(_warm_up())
+
 # --- Input Schema ---
 
 class UserAnswer(BaseModel):
@@ -85,10 +277,34 @@ class UserAnswer(BaseModel):
     answer_text: str
     force_refresh: Optional[bool] = False  # Option to bypass cache
 
-# --- Protected Endpoint ---
+MAX_BATCH_ANSWERS = 64  # Upper bound on answers per /evaluate_answers_batch call
+
+# --- Scoring ---
+
+def _build_result(question_id: int, question: dict, sims: np.ndarray, user_id: str):
+    """Turn one answer's similarity row into the /evaluate_answer response body."""
+    # Find best match
+    best_index = int(np.argmax(sims))
+
+    # Round every score in one vectorized pass (float64 first, so the
+    # rounded values stay exact when converted to Python floats)
+    rounded_scores = np.round(sims.astype(np.float64), 3).tolist()
+    return {
+        "question_id": question_id,
+        "question": question["question"],
+        "best_match_sample": question["answers"][best_index],
+        "similarity_score": rounded_scores[best_index],
+        "user_who_submitted": user_id,  # Include the user ID in the response
+        "all_scores": [
+            {"sample": ans, "score": score}
+            for ans, score in zip(question["answers"], rounded_scores)
+        ]
+    }
+
+# --- Protected Endpoints ---
 
 @app.post("/evaluate_answer")
-def evaluate_answer(
+async def evaluate_answer(
     data: UserAnswer,
     # This is the dependency that protects the endpoint.
     # If the token is invalid, it will stop here and return a 401 error.
@@ -101,81 +317,125 @@ def evaluate_answer(
         print(f"Authenticated user {user_id} ({user_email}) is submitting an answer.")
 
         # Load question with embeddings on-demand
-        question = get_question_with_embeddings(data.question_id, use_cache=not data.force_refresh)
+        question = await get_question_with_embeddings(data.question_id, use_cache=not data.force_refresh)
         
         if not question:
             raise HTTPException(status_code=404, detail=f"Question ID {data.question_id} not found.")
         
         # This is the corrected check.
-        # We just need to check if the length of the embeddings list/tensor is zero.
+        # We just need to check if the embeddings matrix has zero rows.
         if len(question.get("embeddings", [])) == 0:
             raise HTTPException(status_code=500, detail=f"Question ID {data.question_id} has no reference answers.")
 
-        # Encode the user's answer
-        user_emb = model.encode(data.answer_text, convert_to_tensor=True)
+        # Encode the user's answer on the worker pool so the event loop stays free
+        loop = asyncio.get_running_loop()
+        user_emb = await loop.run_in_executor(encode_pool, encode, data.answer_text)
         
-        # Compute cosine similarity
-        similarities = util.cos_sim(user_emb, question["embeddings"])[0].tolist()
-        
-        # Find best match
-        best_score = max(similarities)
-        best_index = similarities.index(best_score)
+        # Compute cosine similarity (embeddings are L2-normalized, so a dot product is enough).
+        # Stays a float32 ndarray until the single .tolist() for the response.
+        sims = compute_similarities(question["embeddings"], user_emb)
+        result = _build_result(data.question_id, question, sims, user_id)
 
         # --- THIS IS THE MISSING PIECE ---
         # Now you can connect to your other services
         
         # 1. TODO: Save to your (PostgreSQL/Firestore) database
-        #    save_answer_to_db(user_id, data.question_id, best_score)
+        #    save_answer_to_db(user_id, data.question_id, result["similarity_score"])
         
         # 2. TODO: Get the 'delta' and update the Redis leaderboard
         #    old_score = get_old_score_from_db(user_id, data.question_id)
-        #    score_delta = best_score - old_score
+        #    score_delta = result["similarity_score"] - old_score
         #    # r.zincrby(LEADERBOARD_KEY, score_delta, user_id)
         
-        return {
-            "question_id": data.question_id,
-            "question": question["question"],
-            "best_match_sample": question["answers"][best_index],
-            "similarity_score": round(best_score, 3),
-            "user_who_submitted": user_id,  # Include the user ID in the response
-            "all_scores": [
-                {"sample": ans, "score": round(score, 3)}
-                for ans, score in zip(question["answers"], similarities)
-            ]
-        }
+        return result
     except Exception as e:
         # Use HTTPException for proper error responses
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
+@app.post("/evaluate_answers_batch")
+async def evaluate_answers_batch(
+    answers: List[UserAnswer],
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Score several answers at once. All answer texts are encoded in a single
+    transformer pass, then each question's answers are scored against its
+    reference matrix with one matrix product. Results keep the input order.
+    """
+    if len(answers) > MAX_BATCH_ANSWERS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_ANSWERS} answers per batch.")
+
+    try:
+        user_id = current_user["uid"]
+
+        # Group answer positions by question so each question is loaded and scored once
+        groups: Dict[int, List[int]] = defaultdict(list)
+        for i, a in enumerate(answers):
+            groups[a.question_id].append(i)
+
+        loop = asyncio.get_running_loop()
+        questions, user_embs = await asyncio.gather(
+            asyncio.gather(*(
+                get_question_with_embeddings(
+                    qid, use_cache=not any(answers[i].force_refresh for i in idx)
+                )
+                for qid, idx in groups.items()
+            )),
+            loop.run_in_executor(encode_pool, encode, [a.answer_text for a in answers]),
+        )
+
+        results: List[Optional[dict]] = [None] * len(answers)
+        for (qid, idx), question in zip(groups.items(), questions):
+            if not question:
+                raise HTTPException(status_code=404, detail=f"Question ID {qid} not found.")
+            if len(question.get("embeddings", [])) == 0:
+                raise HTTPException(status_code=500, detail=f"Question ID {qid} has no reference answers.")
+
+            # (n_group_answers, 768) @ (768, n_refs): one GEMM for the whole group
+            sims_matrix = compute_similarities(question["embeddings"], user_embs[idx])
+            for i, sims in zip(idx, sims_matrix):
+                results[i] = _build_result(qid, question, sims, user_id)
+        return results
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
 # --- Utility Endpoints (Updated for new cache) ---
 
+# Cache endpoints are async so they run on the event loop, never in a worker thread
+
 @app.get("/cache/stats")
-def get_cache_stats():
+async def get_cache_stats():
     """Get cache statistics"""
-    with question_cache_lock:
-        return {
-            "cached_questions": question_cache.currsize,
-            "max_questions": question_cache.maxsize,
-            "cache_ttl_seconds": question_cache.ttl,
-            "cached_question_ids": list(question_cache.keys())
-        }
+    cached_question_ids = list(question_cache)
+    return {
+        "cached_questions": len(cached_question_ids),
+        "max_questions": MAX_CACHED_QUESTIONS,
+        "cache_ttl_seconds": CACHE_TTL,
+        "cached_question_ids": cached_question_ids
+    }
 
 @app.delete("/cache/clear")
-def clear_cache():
+async def clear_cache():
     """Clear all cached questions"""
-    with question_cache_lock:
-        question_cache.clear()
+    question_cache.clear()
     return {"message": "Cache cleared successfully"}
 
 @app.delete("/cache/question/{question_id}")
-def clear_question_cache(question_id: int):
+async def clear_question_cache(question_id: int):
     """Clear cache for a specific question"""
-    with question_cache_lock:
-        if question_id in question_cache:
-            del question_cache[question_id]
-            return {"message": f"Cache cleared for question {question_id}"}
-        else:
-            raise HTTPException(status_code=404, detail=f"Question {question_id} not found in cache")
+    if question_cache.pop(question_id, None) is not None:
+        return {"message": f"Cache cleared for question {question_id}"}
+    else:
+        raise HTTPException(status_code=404, detail=f"Question {question_id} not found in cache")
+
+@app.get("/ready")
+def readiness():
+    """Readiness probe: 200 once reference data is loaded and embedded"""
+    if not reference_data_ready:
+        raise HTTPException(status_code=503, detail="Reference data is still loading")
+    return {"status": "ready", "questions_loaded": reference_question_count}
 
 @app.get("/questions/list")
 def list_all_questions():
@@ -1,15 +1,32 @@
 import firebase_admin
-from firebase_admin import credentials, auth, firestore
+from functools import lru_cache
+from threading import Lock
+from firebase_admin import credentials, auth, firestore, firestore_async
 
 # Path to your downloaded Firebase service account key
-cred = credentials.Certificate("serviceAccountKey.json")
+SERVICE_ACCOUNT_PATH = "serviceAccountKey.json"
 
-# Initialize Firebase app only once
-if not firebase_admin._apps:
-    firebase_admin.initialize_app(cred)
+_init_lock = Lock()  # Startup warm-up and the first request may race to initialize
 
-# Get Firestore client
-db = firestore.client()
+# Everything is created on first use, so importing this module does no I/O
+@lru_cache(maxsize=None)
+def get_app():
+    """Initialize the Firebase app only once."""
+    with _init_lock:
+        if not firebase_admin._apps:
+            cred = credentials.Certificate(SERVICE_ACCOUNT_PATH)
+            return firebase_admin.initialize_app(cred)
+        return firebase_admin.get_app()
+
+@lru_cache(maxsize=None)
+def get_db():
+    """Get Firestore client"""
+    return firestore.client(app=get_app())
+
+@lru_cache(maxsize=None)
+def get_async_db():
+    """Async client for request handlers, so Firestore reads don't hold a worker thread"""
+    return firestore_async.client(app=get_app())
 
 
 # 2. ADD THIS LINE to export the auth module
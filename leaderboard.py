@@ -10,12 +10,29 @@ router = APIRouter()
 # Read from environment variables, with defaults for local dev
 REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.environ.get("REDIS_PORT", 6379))
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", 32))
 # --- Redis Connection ---
 # Make sure Redis server is running locally (port 6379)
-r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+# A blocking pool shares connections across worker threads (waiting when all are busy),
+# and redis-py picks the faster hiredis reply parser automatically when it's installed.
+pool = redis.BlockingConnectionPool(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=0,
+    decode_responses=True,
+    max_connections=REDIS_MAX_CONNECTIONS,
+)
+r = redis.Redis(connection_pool=pool)
 
 LEADERBOARD_KEY = "tonequest_leaderboard"
 
+# Increment a score and read back the new rank atomically, in one round-trip
+INCR_AND_RANK = r.register_script("""
+local score = redis.call('ZINCRBY', KEYS[1], ARGV[1], ARGV[2])
+local rank = redis.call('ZREVRANK', KEYS[1], ARGV[2])
+return {score, rank}
+""")
+
 # --- Request Models ---
 class ScoreUpdate(BaseModel):
     user_id: str
@@ -25,18 +42,14 @@ class ScoreUpdate(BaseModel):
 @router.post("/submit_score")
 def submit_score(data: ScoreUpdate):
     try:
-        # Increment (or decrement) user's score in sorted set
-        r.zincrby(LEADERBOARD_KEY, data.delta, data.user_id)
-        new_score = r.zscore(LEADERBOARD_KEY, data.user_id)
-
-        # zscore may return None or a string (because decode_responses=True)
-        if new_score is None:
-            raise HTTPException(status_code=404, detail="User not found after update (unexpected)")
-
-        new_score = float(new_score)
-        return {"message": "Score updated", "user_id": data.user_id, "new_score": round(new_score, 2)}
-    except HTTPException:
-        raise
+        # Increment (or decrement) user's score and fetch the new rank server-side
+        new_score, rank_0_idx = INCR_AND_RANK(keys=[LEADERBOARD_KEY], args=[data.delta, data.user_id])
+        return {
+            "message": "Score updated",
+            "user_id": data.user_id,
+            "new_score": round(float(new_score), 2),
+            "rank": int(rank_0_idx) + 1,  # Convert 0-index to 1-index for display
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -57,12 +70,14 @@ def get_top_players(n: int):
 @router.get("/leaderboard/user/{user_id}")
 def get_user_rank(user_id: str):
     try:
-        # Get the user's 0-indexed rank
-        rank_0_idx = r.zrevrank(LEADERBOARD_KEY, user_id)
+        # Get the user's 0-indexed rank and score in one round-trip
+        with r.pipeline(transaction=False) as pipe:
+            pipe.zrevrank(LEADERBOARD_KEY, user_id)
+            pipe.zscore(LEADERBOARD_KEY, user_id)
+            rank_0_idx, score = pipe.execute()
         if rank_0_idx is None:
             raise HTTPException(status_code=404, detail="User not found in leaderboard")
         
-        score = r.zscore(LEADERBOARD_KEY, user_id)
         if score is None:
             # This should be impossible if rank exists, but good to check
             raise HTTPException(status_code=404, detail="User score not found")
@@ -0,0 +1,71 @@
+import time
+
+import pytest
+from fastapi import HTTPException
+from firebase_admin.auth import ExpiredIdTokenError, InvalidIdTokenError
+
+import auth
+
+
+@pytest.fixture(autouse=True)
+def isolated_auth(monkeypatch):
+    # Never touch a real Firebase app, and start every test with an empty cache
+    monkeypatch.setattr(auth, "get_app", lambda: None)
+    auth._token_cache.clear()
+    yield
+    auth._token_cache.clear()
+
+
+def test_cached_token_within_exp_skips_verification(monkeypatch):
+    calls = []
+
+    def verify(token, app=None):
+        calls.append(token)
+        return {"uid": "user-1", "exp": time.time() + 600}
+
+    monkeypatch.setattr(auth.firebase_auth, "verify_id_token", verify)
+
+    first = auth.get_current_user("token-a")
+    second = auth.get_current_user("token-a")
+
+    assert first == second
+    assert calls == ["token-a"]
+
+
+def test_cached_token_past_exp_is_reverified(monkeypatch):
+    now = time.time()
+    monkeypatch.setattr(
+        auth.firebase_auth, "verify_id_token",
+        lambda token, app=None: {"uid": "user-1", "exp": now + 60},
+    )
+    auth.get_current_user("token-a")
+
+    # Jump past the token's exp; Firebase now rejects it
+    monkeypatch.setattr(auth.time, "time", lambda: now + 120)
+
+    def verify_expired(token, app=None):
+        raise ExpiredIdTokenError("Token expired", cause=None)
+
+    monkeypatch.setattr(auth.firebase_auth, "verify_id_token", verify_expired)
+
+    with pytest.raises(HTTPException) as exc_info:
+        auth.get_current_user("token-a")
+    assert exc_info.value.status_code == 401
+
+
+def test_invalid_token_is_not_cached(monkeypatch):
+    calls = []
+
+    def verify_invalid(token, app=None):
+        calls.append(token)
+        raise InvalidIdTokenError("Bad signature")
+
+    monkeypatch.setattr(auth.firebase_auth, "verify_id_token", verify_invalid)
+
+    for _ in range(2):
+        with pytest.raises(HTTPException) as exc_info:
+            auth.get_current_user("bad-token")
+        assert exc_info.value.status_code == 401
+
+    assert calls == ["bad-token", "bad-token"]
+    assert len(auth._token_cache) == 0
@@ -0,0 +1,37 @@
+from encoder import _length_sorted_batches
+
+
+def test_batches_are_sorted_longest_first():
+    lengths = [3, 10, 5, 7]
+    assert _length_sorted_batches(lengths, batch_size=32, max_batch_tokens=1000) == [[1, 3, 2, 0]]
+
+
+def test_batch_size_closes_batch():
+    lengths = [5, 5, 5, 5, 5]
+    assert _length_sorted_batches(lengths, batch_size=2, max_batch_tokens=1000) == [[0, 1], [2, 3], [4]]
+
+
+def test_token_budget_closes_batch():
+    # [10, 9] pads to 2 x 10 = 20 tokens; adding 8 would make 3 x 10 = 30 > 25
+    lengths = [10, 9, 8, 2]
+    assert _length_sorted_batches(lengths, batch_size=32, max_batch_tokens=25) == [[0, 1], [2, 3]]
+
+
+def test_text_longer_than_budget_gets_its_own_batch():
+    assert _length_sorted_batches([50, 4], batch_size=32, max_batch_tokens=10) == [[0], [1]]
+
+
+def test_every_index_appears_exactly_once():
+    lengths = [7, 1, 12, 3, 3, 9, 40, 2]
+    batches = _length_sorted_batches(lengths, batch_size=3, max_batch_tokens=30)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    assert all(len(batch) <= 3 for batch in batches)
+    # Only a lone over-long text may exceed the padded-token budget
+    assert all(
+        len(batch) == 1 or len(batch) * max(lengths[i] for i in batch) <= 30
+        for batch in batches
+    )
+
+
+def test_empty_input():
+    assert _length_sorted_batches([], batch_size=32, max_batch_tokens=4096) == []
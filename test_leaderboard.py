@@ -0,0 +1,62 @@
+import fakeredis
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import leaderboard
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    # Lua scripts need fakeredis' `lua` extra (lupa)
+    fake = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(leaderboard, "r", fake)
+    monkeypatch.setattr(leaderboard, "INCR_AND_RANK", fake.register_script(leaderboard.INCR_AND_RANK.script))
+    return fake
+
+
+@pytest.fixture
+def client(fake_redis):
+    app = FastAPI()
+    app.include_router(leaderboard.router)
+    return TestClient(app)
+
+
+def submit(client, user_id, delta):
+    response = client.post("/submit_score", json={"user_id": user_id, "delta": delta})
+    assert response.status_code == 200
+    return response.json()
+
+
+def assert_matches_redis(fake_redis, body):
+    user_id = body["user_id"]
+    assert body["new_score"] == round(fake_redis.zscore(leaderboard.LEADERBOARD_KEY, user_id), 2)
+    assert body["rank"] == fake_redis.zrevrank(leaderboard.LEADERBOARD_KEY, user_id) + 1
+
+
+def test_submit_score_returns_new_score_and_rank(client, fake_redis):
+    assert submit(client, "alice", 10)["rank"] == 1
+    bob = submit(client, "bob", 25)
+    assert bob["new_score"] == 25.0
+    assert bob["rank"] == 1
+
+    carol = submit(client, "carol", 15)
+    assert carol["rank"] == 2
+    assert_matches_redis(fake_redis, carol)
+
+    # Increments accumulate onto the existing score
+    alice = submit(client, "alice", 20)
+    assert alice["new_score"] == 30.0
+    assert alice["rank"] == 1
+    assert_matches_redis(fake_redis, alice)
+
+
+def test_negative_delta_moves_user_down(client, fake_redis):
+    submit(client, "alice", 30)
+    submit(client, "bob", 20)
+    submit(client, "carol", 10)
+
+    alice = submit(client, "alice", -25.5)
+    assert alice["new_score"] == 4.5
+    assert alice["rank"] == 3
+    assert_matches_redis(fake_redis, alice)